@@ -29,6 +29,10 @@ def getOptions() -> dict:
     if not 'LOG_LEVEL' in os.environ:
         os.environ['LOG_LEVEL'] = opts.log_level
         log.setLevel(opts.log_level)
+    # Most invocations are just `asthralios <action>`; skip the parsing loop for that shape.
+    if len(other) == 1 and other[0] in ACTIONS:
+        opts.action = other[0]
+        return opts.__dict__
     action = None
     # If any() of the above constant actions is among the unknown arguments, pop it off the list
     # and set the action accordingly.
@@ -19,16 +19,19 @@ class LocalGPT:
     This is a client that connects to a local instance of ollama.
     '''
 
-    def __init__(self, host: str='127.0.0.1', port: int=11434):
-        self.prefix = f'http://{host}:{port}'
-        self.http = urllib3.PoolManager()
-        self.conversation: list[Message] = [Message('system', """
+    # Built once at import time and shared by every instance's conversation.
+    SYSTEM_PROMPT = Message('system', """
 You are a helpful assistant named Asthralios and you serve me, Markizano. You have an aulturistic 
 tone like Alfred is to Batman and Jarvis is to Iron Man but without the written expressions of the 
 face since all text will be turned into a voice response. You are a voice assistant that can help 
 with a variety of tasks. You are careful with your words since you only have a few to communicate 
 at a time.
-""".strip())]
+""".strip())
+
+    def __init__(self, host: str='127.0.0.1', port: int=11434):
+        self.prefix = f'http://{host}:{port}'
+        self.http = urllib3.PoolManager()
+        self.conversation: list[Message] = [self.SYSTEM_PROMPT]
 
     def chatExchange(self, text: str) -> str:
         '''
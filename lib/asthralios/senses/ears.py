@@ -1,9 +1,16 @@
 import os
+import io
+import functools
+import logging
 import random
 import pasimple
 import numpy as np
 import multiprocessing as mp
+from multiprocessing import shared_memory
+import queue
+import threading
 import urllib3, urllib
+import wave
 import re
 import time
 import traceback as tb
@@ -25,6 +32,28 @@ TTS_MODEL = os.environ.get('TTS_MODEL', 'tts_models/multilingual/multi-dataset/x
 TTS_TYPE = os.environ.get('TTS_TYPE', 'local').lower()
 TTS_ADAPTER = os.environ.get('ADAPTER', 'api').lower()
 LANGUAGE = os.environ.get('LANGUAGE', 'en')
+# What we mutter while the user is still talking.
+ACKNOWLEDGEMENTS = ('uh-huh...', 'I hear you ...', 'yeap...', 'mm-hmm...', 'yes...', 'I am listening...')
+
+@functools.lru_cache(maxsize=1)
+def getWhisperModel(model: str, device: str, compute_type: str) -> WhisperModel:
+    '''
+    Load the Whisper model once per process; every Conversation with the same settings shares it.
+    Call getWhisperModel.cache_clear() to drop the model and release its memory.
+    '''
+    whisper = WhisperModel(model, device=device, compute_type=compute_type, cpu_threads=os.cpu_count())
+    # Run one second of silence through the model so kernel selection doesn't stall the first query.
+    segments, _ = whisper.transcribe(np.zeros(PulseClient.SAMPLE_SIZE, dtype=np.float32), language=LANGUAGE)
+    list(segments)
+    return whisper
+
+@functools.lru_cache(maxsize=1)
+def getTTS(model: str, device: str) -> TTS:
+    '''
+    Load the TTS API model once per process; every Conversation with the same settings shares it.
+    Call getTTS.cache_clear() to drop the model and release its memory.
+    '''
+    return TTS(model).to(device=torch.device(device))
 
 class ProcessQueue(NamedTuple):
     '''
@@ -47,6 +76,15 @@ class PulseClient(object):
     This takes the heavy burden off of the main thread and allows for a more responsive interface.
     '''
     SAMPLE_SIZE = 16000
+    # Utterances allowed to pile up from the mic before the reader blocks and waits for transcription.
+    LISTEN_BACKLOG = 4
+    # Longest utterance that fits in a shared-memory slot (one minute).
+    UTTERANCE_SIZE = SAMPLE_SIZE * 60
+    # The output ring: SPEAK_BACKLOG slots of SPEAK_SIZE int16 samples (two seconds at 48kHz in total).
+    SPEAK_BACKLOG = 4
+    SPEAK_SIZE = 24000
+    # How many times to retry opening a PulseAudio stream, backing off up to 8s between attempts.
+    CONNECT_RETRIES = 5
 
     def __init__(self, config: kizano.Config):
         self.config = config
@@ -58,7 +96,7 @@ class PulseClient(object):
             window_size_samples=1024,
             speech_pad_ms=250,
         )
-        iq = mp.Queue()
+        iq = mp.Queue(maxsize=PulseClient.LISTEN_BACKLOG)
         oq = mp.Queue()
         self.pool: PulseIO = PulseIO(
             ProcessQueue(mp.Process(target=self.streamWords, args=(iq,)), iq),
@@ -67,10 +105,25 @@ class PulseClient(object):
         self._istream: pasimple.PaSimple = None
         self._ostream: pasimple.PaSimple = None
         self._listening: bool = False
+        self._chunk: np.ndarray = np.empty(PulseClient.SAMPLE_SIZE, dtype=np.float32)
+        self._vad = None
+        self._vad_initial_state = None
+        # Samples past the last whole VAD window of a chunk, run at the front of the next one.
+        self._vad_tail: np.ndarray = np.empty(0, dtype=np.float32)
+        # Utterances are handed from the mic process to the listener through these shared slots;
+        # only the (slot, length) pair goes through the input queue.
+        self._heard = shared_memory.SharedMemory(create=True,
+            size=PulseClient.LISTEN_BACKLOG * PulseClient.UTTERANCE_SIZE * np.dtype(np.float32).itemsize)
+        self._free_slots = mp.Semaphore(PulseClient.LISTEN_BACKLOG)
+        # Likewise, speech goes to the output process through a small ring of shared slots.
+        self._spoken = shared_memory.SharedMemory(create=True,
+            size=PulseClient.SPEAK_BACKLOG * PulseClient.SPEAK_SIZE * np.dtype(np.int16).itemsize)
+        self._free_speech = mp.Semaphore(PulseClient.SPEAK_BACKLOG)
+        self._speech_slot = 0
 
     def __del__(self):
         '''
-        Clean up the pool of processes.
+        Clean up the pool of processes and the shared utterance slots.
         '''
         if self.pool.input.process.is_alive():
             self.pool.input.process.terminate()
@@ -82,6 +135,11 @@ class PulseClient(object):
             if self.pool.output.process._Popen is not None:
                 self.pool.output.process.join()
 
+        self._heard.close()
+        self._heard.unlink()
+        self._spoken.close()
+        self._spoken.unlink()
+
     @property
     def listening(self) -> bool:
         '''
@@ -104,12 +162,17 @@ class PulseClient(object):
     def _next_chunk(self, stream: pasimple.PaSimple) -> np.ndarray:
         '''
         Read the next chunk of audio from the stream.
+        The returned array is a view of a buffer that is overwritten by the next call.
         '''
-        audio = np.frombuffer(
+        pcm = np.frombuffer(
             stream.read(PulseClient.SAMPLE_SIZE * pasimple.format2width(stream.format())),
             dtype=np.int16
-        ).astype(np.float32) / 32768.0
-        return audio[~np.isnan(audio) & ~np.isinf(audio)]
+        )
+        # Scale straight into the reused buffer in one pass. int16 PCM can never be NaN or Inf,
+        # so there is nothing to filter out afterwards.
+        audio = self._chunk[:len(pcm)]
+        np.multiply(pcm, 1.0 / 32768.0, out=audio, casting='unsafe')
+        return audio
 
     def getPulseInput(self) -> pasimple.PaSimple:
         if not self._istream:
@@ -131,44 +194,115 @@ class PulseClient(object):
                 stream_name='asthralios-voice')
         return self._ostream
 
+    def getVAD(self) -> tuple:
+        '''
+        Load the VAD model and its initial state once per process.
+        This is called from the listener process so the ONNX session is never shared across a fork.
+        The model returns a new state on every call, so the initial state can be reused as-is.
+        '''
+        if self._vad is None:
+            self._vad = get_vad_model()
+            self._vad_initial_state = self._vad.get_initial_state(batch_size=1)
+        return self._vad, self._vad_initial_state
+
+    def _heardSlots(self) -> np.ndarray:
+        '''
+        View the shared utterance slots as a (LISTEN_BACKLOG, UTTERANCE_SIZE) float32 array.
+        '''
+        return np.ndarray((PulseClient.LISTEN_BACKLOG, PulseClient.UTTERANCE_SIZE), dtype=np.float32, buffer=self._heard.buf)
+
+    def _spokenSlots(self) -> np.ndarray:
+        '''
+        View the shared speech slots as a (SPEAK_BACKLOG, SPEAK_SIZE) int16 array.
+        '''
+        return np.ndarray((PulseClient.SPEAK_BACKLOG, PulseClient.SPEAK_SIZE), dtype=np.int16, buffer=self._spoken.buf)
+
+    def connect(self, open_stream, name: str) -> pasimple.PaSimple:
+        '''
+        Open a PulseAudio stream with getPulseInput/getPulseOutput, retrying with exponential backoff.
+        Returns None once the retries are exhausted.
+        '''
+        for attempt in range(PulseClient.CONNECT_RETRIES + 1):
+            try:
+                return open_stream()
+            except pasimple.PaSimpleError as e:
+                if attempt == PulseClient.CONNECT_RETRIES:
+                    log.error(f"Error creating {name}: {e}")
+                    return None
+                delay = min(2 ** attempt, 8)
+                log.warning(f"Error creating {name}, retrying in {delay}s: {e}")
+                time.sleep(delay)
+
+    def speechProbability(self, vad, vad_state, audio: np.ndarray, rate: int) -> tuple:
+        '''
+        Run the VAD over a chunk one window at a time, the frame size Silero is built for, carrying the
+        state across windows. The window covers the same stretch of time at any stream rate, so it is
+        never too short for the model. Samples past the last whole window are carried into the next chunk.
+        Returns the highest speech probability seen in the chunk and the new state.
+        '''
+        window = self.vad_options.window_size_samples * rate // PulseClient.SAMPLE_SIZE
+        if len(self._vad_tail):
+            audio = np.concatenate((self._vad_tail, audio))
+        end = len(audio) - len(audio) % window
+        speech_prob = 0.0
+        for i in range(0, end, window):
+            prob, vad_state = vad(audio[i:i + window], vad_state, rate)
+            speech_prob = max(speech_prob, prob)
+        # The chunk is a view of a reused buffer, so keep a copy of what's left.
+        self._vad_tail = audio[end:].copy()
+        return speech_prob, vad_state
+
     def getSoundOfWords(self, stream: pasimple.PaSimple, doneListening: int = 2) -> np.ndarray:
         '''
         Listen to the stream until silence is detected for 2s.
         Yield audio chunks as long as there is speech.
         @param doneListening: The number of seconds of silence to wait before stopping.
         '''
-        result = np.array([]).astype(np.float32)
+        # Start with room for a minute of speech and double when a longer utterance fills it.
+        result = np.empty(PulseClient.UTTERANCE_SIZE, dtype=np.float32)
+        heard = 0
         audio = self._next_chunk(stream)
         silence = 0 # number of seconds we hear relative "silence" or speech below threshold
         has_spoken = False
-        vad = get_vad_model()
-        vad_state = vad.get_initial_state(batch_size=1)
+        vad, vad_state = self.getVAD()
+        self._vad_tail = self._vad_tail[:0]
         while silence < doneListening:
-            speech_prob, vad_state = vad(audio, vad_state, stream.rate())
+            speech_prob, vad_state = self.speechProbability(vad, vad_state, audio, stream.rate())
             if speech_prob > self.vad_options.threshold:
                 silence = 0
                 has_spoken = True
-                log.info([random.choice(tuple(['uh-huh...', 'I hear you ...', 'yeap...', 'mm-hmm...', 'yes...', 'I am listening...']))])
-                result = np.concatenate((result, audio), dtype=np.float32)
+                if log.isEnabledFor(logging.INFO):
+                    log.info(random.choice(ACKNOWLEDGEMENTS))
+                if heard + len(audio) > len(result):
+                    result = np.resize(result, max(len(result) * 2, heard + len(audio)))
+                result[heard:heard + len(audio)] = audio
+                heard += len(audio)
             else:
                 if has_spoken:
                     silence += 1
                 else:
                     log.debug("(I haven't heard you yet...).")
             audio = self._next_chunk(stream)
-        log.info(f'Heard {silence} seconds of post-speech silence. Collected {len(result)} samples.')
-        return result
+        log.info(f'Heard {silence} seconds of post-speech silence. Collected {heard} samples.')
+        return result[:heard]
 
     def speak(self, audio: np.ndarray):
         '''
         Speak the audio to the output stream.
-        Buffer/stream the audio if it is too long.
-        '''
-        # if len(audio) > self.SAMPLE_SIZE * 3:
-        #     for i in range(0, len(audio), self.SAMPLE_SIZE):
-        #         self.pool.output.queue.put(audio[i:i+self.SAMPLE_SIZE])
-        # else:
-        self.pool.output.queue.put(audio)
+        The audio is copied into the shared speech slots a slot at a time, so this blocks once the
+        output process is more than SPEAK_BACKLOG slots behind.
+        If the output process has gone away, the rest of the audio is dropped rather than waited on forever.
+        '''
+        slots = self._spokenSlots()
+        for i in range(0, len(audio), PulseClient.SPEAK_SIZE):
+            frame = audio[i:i + PulseClient.SPEAK_SIZE]
+            while not self._free_speech.acquire(timeout=1):
+                if not self.pool.output.process.is_alive():
+                    log.error('The output stream is gone; dropping the rest of this speech.')
+                    return
+            slots[self._speech_slot, :len(frame)] = frame
+            self.pool.output.queue.put((self._speech_slot, len(frame)))
+            self._speech_slot = (self._speech_slot + 1) % PulseClient.SPEAK_BACKLOG
 
     def listen(self) -> Generator[np.ndarray, None, None]:
         '''
@@ -176,8 +310,21 @@ class PulseClient(object):
         Run self.doListen() in a subprocess and receive chunks via a queue to ensure we are always pulling the latest
         audio from the stream and storing it in a local buffer.
         '''
+        slots = self._heardSlots()
         while self.listening:
-            audio = self.pool.input.queue.get()
+            try:
+                heard = self.pool.input.queue.get(timeout=1)
+            except queue.Empty:
+                # Nothing more will arrive once the mic process is gone, so don't wait on it forever.
+                if not self.pool.input.process.is_alive():
+                    raise RuntimeError(f'The microphone process exited with code {self.pool.input.process.exitcode}.')
+                continue
+            if isinstance(heard, np.ndarray):
+                yield heard
+                continue
+            slot, length = heard
+            audio = slots[slot, :length].copy()
+            self._free_slots.release()
             yield audio
         return False
 
@@ -185,33 +332,42 @@ class PulseClient(object):
         '''
         Stream audio from the mic to a queue.
         '''
-        try:
-            stream = self.getPulseInput()
-        except pasimple.PaSimpleError as e:
-            log.error(f"Error creating input: {e}")
-            import pdb
-            pdb.set_trace()
+        stream = self.connect(self.getPulseInput, 'input')
+        if stream is None:
             return 1
+        slots = self._heardSlots()
+        slot = 0
         while self.listening:
             audio = self.getSoundOfWords(stream, 2)
-            q.put(audio)
+            if len(audio) > PulseClient.UTTERANCE_SIZE:
+                # Too long for a slot; send this one through the pipe instead.
+                q.put(audio)
+                continue
+            # Slots are used and released in order, so the one we wait on is always the oldest.
+            self._free_slots.acquire()
+            slots[slot, :len(audio)] = audio
+            q.put((slot, len(audio)))
+            slot = (slot + 1) % PulseClient.LISTEN_BACKLOG
         return 0
 
     def streamSpeech(self, q: mp.Queue) -> int:
         '''
         @async
-        Stream audio from the mic to a queue.
+        Play the speech slots named on the queue to the speakers until a None arrives.
         '''
-        try:
-            stream = self.getPulseOutput()
-        except pasimple.PaSimpleError as e:
-            log.error(f"Error creating output: {e}")
+        stream = self.connect(self.getPulseOutput, 'output')
+        if stream is None:
             return 1
-        
-        audio: np.ndarray = q.get()
-        while audio is not None:
-            stream.write(audio.tobytes())
-            audio = q.get()
+
+        slots = self._spokenSlots()
+        spoken = q.get()
+        while spoken is not None:
+            slot, length = spoken
+            # pasimple wants bytes; taking them is the one copy out of the slot, so free it before playing.
+            audio = slots[slot, :length].tobytes()
+            self._free_speech.release()
+            stream.write(audio)
+            spoken = q.get()
         return 0
 
     def stop(self):
@@ -235,24 +391,32 @@ class Conversation(object):
         self.config = config
         log.info('Connecting to ears and voicebox...')
         self.pulse = PulseClient(config)
+        # Fork the mic and speaker processes now, before CUDA and the compile workers start threads
+        # that a forked child could inherit mid-lock.
+        self.listening = True
         log.info('Loading language-interpreter model...')
-        self.model = WhisperModel(
+        self.model = getWhisperModel(
             config.get('whisper.model', WHISPER_MODEL),
-            device=config.get('whisper.device', 'cuda'),
-            compute_type=config.get('whisper.compute_type', 'auto'),
-            cpu_threads=os.cpu_count(),
+            config.get('whisper.device', 'cuda'),
+            # INT8 weights with FP16 activations; set whisper.compute_type to float16 for bit-exact FP16.
+            config.get('whisper.compute_type', 'int8_float16'),
         )
         log.info('Loading vocal chords...')
+        # Half precision TTS is opt-in with tts.fp16; some voices click when the vocoder runs in FP16.
+        self.fp16 = bool(config.get('tts', {}).get('fp16', False)) and torch.cuda.is_available()
         if self.isTTSLocal():
             if TTS_ADAPTER == 'api':
                 device = "cuda" if torch.cuda.is_available() else "cpu"
                 tts_model_name = config.get('tts', {}).get('model', TTS_MODEL)
-                self.tts = TTS(tts_model_name).to(device=torch.device(device))
+                self.tts = getTTS(tts_model_name, device)
             elif TTS_ADAPTER == 'model':
                 self.loadXTTSModel()
 
+        # Keep connections to the remote TTS server alive between paragraphs.
+        self.http = urllib3.PoolManager(num_pools=2, maxsize=8, retries=urllib3.Retry(3, backoff_factor=0.2))
         self.gpt = gpt.LocalGPT(host='chatgpt')
-        self.listening = True
+        self.heard: queue.Queue = queue.Queue()
+        self._interpreter: threading.Thread = None
 
     @property
     def listening(self) -> bool:
@@ -273,11 +437,46 @@ class Conversation(object):
         from TTS.tts.models.xtts import Xtts
         self.xtts_config = XttsConfig()
         home = os.environ.get('HOME', '/home/stable-diffusion')
-        self.xtts_config.load_json(f"{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2/config.json")
+        checkpoint_dir = f"{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2"
+        self.speaker_wav = f'{checkpoint_dir}/speaker.wav'
+        self.xtts_config.load_json(f"{checkpoint_dir}/config.json")
         self.tts = Xtts.init_from_config(self.xtts_config)
-        self.tts.load_checkpoint(self.xtts_config, checkpoint_dir=f"{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2/", eval=True)
-        # if torch.cuda.is_available():
-        #     self.tts.cuda()
+        self.tts.load_checkpoint(self.xtts_config, checkpoint_dir=f"{checkpoint_dir}/", eval=True)
+        # The Pulse processes forked before any CUDA use (see __init__), so the model can live on the GPU.
+        if torch.cuda.is_available():
+            self.tts.cuda()
+        # speaker.wav never changes, so encode it into conditioning latents once rather than per paragraph.
+        self.gpt_cond_latent, self.speaker_embedding = self.tts.get_conditioning_latents(audio_path=[self.speaker_wav])
+        # Only compile on CUDA; inductor on the CPU costs minutes of startup for little gain.
+        if torch.cuda.is_available() and self.config.get('tts', {}).get('compile', True):
+            self.compileXTTSModel()
+
+    def compileXTTSModel(self):
+        '''
+        Compile the GPT decoding step and the HiFi-GAN vocoder of the loaded XTTS model and pay the
+        compile cost now with a warmup sentence instead of on the first reply.
+        Set tts.compile_mode to 'reduce-overhead' to have the vocoder and decoding step replayed as CUDA graphs.
+        Falls back to the eager model if compilation fails.
+        '''
+        mode = self.config.get('tts', {}).get('compile_mode', 'default')
+        gpt_forward = self.tts.gpt.gpt_inference.forward
+        vocoder_forward = self.tts.hifigan_decoder.forward
+        try:
+            log.info('Compiling vocal chords...')
+            self.tts.gpt.gpt_inference.forward = torch.compile(gpt_forward, mode=mode, dynamic=True)
+            self.tts.hifigan_decoder.forward = torch.compile(vocoder_forward, mode=mode, dynamic=True)
+            with self.precision():
+                self.tts.inference('Warming up.', LANGUAGE, self.gpt_cond_latent, self.speaker_embedding)
+        except Exception as e:
+            log.warning(f'Could not compile the TTS model, running it eagerly: {e}')
+            self.tts.gpt.gpt_inference.forward = gpt_forward
+            self.tts.hifigan_decoder.forward = vocoder_forward
+
+    def precision(self) -> torch.autocast:
+        '''
+        The autocast context TTS inference runs under: FP16 on CUDA when tts.fp16 is set, a no-op otherwise.
+        '''
+        return torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.fp16)
 
     def voiceToText(self, audio: np.ndarray) -> str:
         '''
@@ -293,35 +492,71 @@ class Conversation(object):
             vad_parameters=self.pulse.vad_options
         )
         log.debug(info)
-        return ' '.join([ segment.text for segment in segments ])
+        return ' '.join(segment.text for segment in segments)
 
 
     def listen(self) -> Generator[str, None, None]:
         '''
         Listen into perpetuity for queries from the end-user.
         Always have your ears open.
+        Errors from the interpreter thread are raised here, and a dead interpreter is restarted.
         '''
         if not self.listening: self.listening = True
-        for audio in self.pulse.listen():
-            yield self.voiceToText(audio)
+        while self.listening:
+            if self._interpreter is None or not self._interpreter.is_alive():
+                if not self.pulse.pool.input.process.is_alive():
+                    # A new interpreter would only fail the same way; stop rather than retry forever.
+                    raise RuntimeWarning('The microphone process is gone.')
+                self._interpreter = threading.Thread(target=self.interpret, name='asthralios-interpreter', daemon=True)
+                self._interpreter.start()
+            try:
+                heard = self.heard.get(timeout=1)
+            except queue.Empty:
+                continue
+            if isinstance(heard, Exception):
+                raise heard
+            yield heard
+
+    def interpret(self):
+        '''
+        @async -- Runs in its own thread for as long as we are listening.
+        Transcribe each utterance as it arrives and queue the text for listen(), so decoding the next
+        query overlaps with answering and speaking the last one.
+        Errors are queued in place of the text so listen() can raise them on the main thread.
+        '''
+        try:
+            for audio in self.pulse.listen():
+                try:
+                    self.heard.put(self.voiceToText(audio))
+                except Exception as e:
+                    # One bad utterance shouldn't stop us hearing the next.
+                    self.heard.put(e)
+        except Exception as e:
+            # The mic side failed; this thread ends and listen() starts a new one.
+            self.heard.put(e)
 
-    def textToVoice(self, text: str, q: mp.Queue) -> int:
+    def textToVoice(self, text: str) -> Generator[np.ndarray, None, None]:
         '''
-        Generate speech from text.
+        Generate speech from text, yielding int16 audio as soon as it is available.
+        The XTTS model adapter streams chunks while it is still decoding the rest of the text.
+        Yields nothing when the remote TTS server plays the audio itself.
         '''
         log.info(f'Text to voice: {text}')
         if self.isTTSLocal():
             if TTS_ADAPTER == 'api':
-                wav = self.tts.tts(text, speed=1.0, split_sentences=True)
+                with self.precision():
+                    wav = self.tts.tts(text, speed=1.0, split_sentences=True)
             elif TTS_ADAPTER == 'model':
-                home = os.environ.get('HOME', '/home/stable-diffusion')
-                speaker_wav = f'{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2/speaker.wav'
-                wav = self.tts.synthesize(text, config=self.xtts_config, speaker_wav=speaker_wav, language=LANGUAGE)
+                with self.precision():
+                    for chunk in self.tts.inference_stream(text, LANGUAGE, self.gpt_cond_latent, self.speaker_embedding, stream_chunk_size=20):
+                        # The whole clip's peak isn't known while streaming; XTTS already emits samples in [-1, 1].
+                        yield np.array(chunk.float().clamp(-1.0, 1.0).cpu().numpy() * 32767, dtype=np.int16)
+                return
+            # Scale in place and cast once; 32767 keeps the peak sample from wrapping around in int16.
             npwav = np.array(wav, dtype=np.float32)
-            audio = np.array(npwav * (32768 / max(0.01, np.max(np.abs(npwav)))), dtype=np.int16)
-            q.put(audio)
+            npwav *= 32767.0 / max(0.01, npwav.max(), -npwav.min())
+            yield npwav.astype(np.int16)
         else:
-            request = urllib3.PoolManager()
             TTS_API = os.environ.get('TTS_API', None)
             if TTS_API == 'tts':
                 params = {
@@ -330,36 +565,36 @@ class Conversation(object):
                     # 'speaker_id': 'Dionisio Schuyler', # Nice deep voice.
                     'speaker_id': 'Filip Traverse', # cute irish accent
                 }
-                response = request.request('GET', 'http://tts/api/tts', fields=params)
+                response = self.http.request('GET', 'http://tts/api/tts', fields=params, preload_content=False)
             elif TTS_API == 'kizano':
                 # urltext = urllib.parse.quote(text)
-                response = request.request('GET', f'http://tts/{text}')
-                return 0 # Return early here because if you are using my API, I will play it from that server.
-            audio = np.frombuffer(response.data, dtype=np.int16)
-            q.put( audio )
-        return 0
+                response = self.http.request('GET', f'http://tts/{text}')
+                return # Return early here because if you are using my API, I will play it from that server.
+            # The reply is a WAV; read its header so it isn't played as samples, then play the frames as they download.
+            # The buffer turns short network reads into the full reads wave expects.
+            with wave.open(io.BufferedReader(response), 'rb') as reply:
+                if reply.getsampwidth() != 2 or reply.getnchannels() != 1:
+                    raise ValueError(f'TTS replied with {reply.getnchannels()} channel(s) of {8 * reply.getsampwidth()}-bit audio; expected 16-bit mono.')
+                rate = self.config.get('output_sample_rate', 48000)
+                if reply.getframerate() != rate:
+                    log.warning(f'TTS replied at {reply.getframerate()}Hz but the speaker plays at {rate}Hz; set output_sample_rate to match.')
+                while (data := reply.readframes(PulseClient.SPEAK_SIZE)):
+                    yield np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+            response.release_conn()
 
     def speak(self, text: str):
         '''
         Speak the text to the user.
+        Paragraphs are synthesized one after another by the single loaded model; audio is handed
+        to the output stream as soon as it is ready, so it plays while the rest is generated.
         '''
         paragraphs = text.split('\n\n')
         log.info(f'Speak paragraphs: {paragraphs}')
-        pool: list[ProcessQueue] = []
+        audio = None
         for paragraph in paragraphs:
-            q = mp.Queue()
-            pq = mp.Process(target=self.textToVoice, args=(paragraph, q))
-            pool.append(ProcessQueue(pq, q))
-            pq.start()
-        log.info(f'started generation of voice clips ({len(pool)})...')
-
-        for i, pq in enumerate(pool):
-            audio = pq.queue.get()
-            log.info(f'Vocalize: {paragraphs[i]}')
-            self.pulse.speak(audio)
-
-        for pq in pool:
-            pq.process.join()
+            log.info(f'Vocalize: {paragraph}')
+            for audio in self.textToVoice(paragraph):
+                self.pulse.speak(audio)
         log.info('Voice clips generated and spoken.')
         return audio
 
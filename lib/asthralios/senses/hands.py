@@ -1,19 +1,20 @@
 
-import os, io, sys
-import json, yaml
+import os, sys
+import csv, json, yaml
 import traceback as tb
 import hashlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Generator
 
 from kizano import getLogger
 
+import sqlalchemy
+
 from langchain_ollama.embeddings import OllamaEmbeddings
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
 
-from langchain_community.vectorstores.pgvector import PGVector
-
-from langchain_community.document_loaders.json_loader import JSONLoader
 from langchain_community.document_loaders.text import TextLoader
 from langchain_community.document_loaders.pdf import PyPDFLoader
 from langchain_community.document_loaders.markdown import UnstructuredMarkdownLoader
@@ -28,7 +29,7 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter, RecursiveJs
 
 log = getLogger(__name__)
 
-SUPPORTED_EXTS = [
+SUPPORTED_EXTS = frozenset([
     'txt',
     'pdf',
     'json',
@@ -45,7 +46,23 @@ SUPPORTED_EXTS = [
     'xml',
     'yaml',
     'yml',
-]
+])
+
+# Loaders for the extensions that need nothing more than the path; JSON, YAML and CSV are read in loadText().
+EXT_LOADERS = {
+    'txt': lambda path: TextLoader(path, autodetect_encoding=True),
+    'pdf': PyPDFLoader,
+    'doc': Docx2txtLoader,
+    'docx': Docx2txtLoader,
+    'ppt': UnstructuredPowerPointLoader,
+    'pptx': UnstructuredPowerPointLoader,
+    'xls': UnstructuredExcelLoader,
+    'xlsx': UnstructuredExcelLoader,
+    'xml': UnstructuredXMLLoader,
+    'md': UnstructuredMarkdownLoader,
+    'html': UnstructuredHTMLLoader,
+    'htm': UnstructuredHTMLLoader,
+}
 
 class Hands(object):
     '''
@@ -65,53 +82,121 @@ class Hands(object):
             base_url=self.config['ollama']['url'],
             model=self.config['ollama']['embeddings'],
         )
+        # One engine, and so one connection pool, shared by PGVector and our own queries.
+        self.engine = sqlalchemy.create_engine(self.config['pgvector']['url'])
         self.db = PGVector(
             embeddings=self.embeddings,
-            connection=self.config['pgvector']['url'],
-            collection_name=self.config['pgvector']['collection']
+            connection=self.engine,
+            collection_name=self.config['pgvector']['collection'],
+            # Without a fixed dimension the embedding column can't carry an HNSW index.
+            embedding_length=self.config['pgvector'].get('embedding_length'),
         )
+        self.batch_size = int(self.config['ollama'].get('batch_size', 32))
+        # Splitters keep no state between calls, so one of each serves every document and thread.
+        self.text_splitter = RecursiveCharacterTextSplitter()
+        self.json_splitter = RecursiveJsonSplitter()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        '''
+        Embed the texts in batches of `ollama.batch_size` so each request to Ollama carries many chunks.
+        '''
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[i:i + self.batch_size]))
+        return vectors
+
+    def knownHashes(self, hashes: list[str]) -> set[str]:
+        '''
+        Given a list of content hashes, return the ones already stored in this collection.
+        One query for the whole batch instead of a similarity search per document.
+        '''
+        if not hashes:
+            return set()
+        query = sqlalchemy.text('''
+            SELECT e.cmetadata->>'content_sha256'
+              FROM langchain_pg_embedding e
+              JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+             WHERE c.name = :collection
+               AND e.cmetadata->>'content_sha256' = ANY(:hashes)
+        ''')
+        with self.engine.connect() as conn:
+            rows = conn.execute(query, {'collection': self.config['pgvector']['collection'], 'hashes': hashes})
+            return {row[0] for row in rows}
+
+    def dropIndex(self) -> None:
+        '''
+        Drop the HNSW index on the embeddings so a bulk ingest doesn't pay to maintain it row by row.
+        '''
+        index = self.config['pgvector'].get('index', 'langchain_pg_embedding_embedding_idx')
+        log.info(f'Dropping index {index} for bulk ingest.')
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.text(f'DROP INDEX IF EXISTS "{index}"'))
+
+    def buildIndex(self) -> None:
+        '''
+        (Re)build the HNSW index on the embeddings in one pass.
+        The embedding column must have a fixed dimension for pgvector to index it; if it doesn't, the
+        rebuild is skipped with a warning. Set pgvector.embedding_length before the tables are created.
+        '''
+        index = self.config['pgvector'].get('index', 'langchain_pg_embedding_embedding_idx')
+        with self.engine.begin() as conn:
+            dimensions = conn.execute(sqlalchemy.text('''
+                SELECT atttypmod FROM pg_attribute
+                 WHERE attrelid = 'langchain_pg_embedding'::regclass AND attname = 'embedding'
+            ''')).scalar()
+            if dimensions is None or dimensions < 0:
+                log.warning(f'The embedding column has no fixed dimension; not building index {index}.')
+                return
+            log.info(f'Building index {index}...')
+            conn.execute(sqlalchemy.text("SET LOCAL maintenance_work_mem = '2GB'"))
+            conn.execute(sqlalchemy.text('SET LOCAL max_parallel_maintenance_workers = 7'))
+            conn.execute(sqlalchemy.text(f'''
+                CREATE INDEX IF NOT EXISTS "{index}" ON langchain_pg_embedding
+                 USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+            '''))
 
     def recurseDirectory(self, path: str) -> Generator[str, None, None]:
         '''
-        Given a path, recurse the directory tree and yield each file path.
+        Given a path, recurse the directory tree and yield the path of each supported file.
+        os.scandir() hands back the file type with each entry, so no extra stat() is needed per file.
         '''
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                yield os.path.join(root, file)
+        try:
+            entries = os.scandir(path)
+        except (NotADirectoryError, FileNotFoundError, PermissionError):
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.recurseDirectory(entry.path)
+                elif os.path.splitext(entry.name)[1][1:].lower() in SUPPORTED_EXTS:
+                    yield entry.path
+                else:
+                    log.warning(f'Unsupported file type: {entry.path}')
 
     def loadText(self, path: str) -> str:
         '''
         Given a path, return the Document() object for each file object read.
         '''
-        ext = path.split('.')[-1]
-        if ext == 'txt':
-            loader = TextLoader(path, autodetect_encoding=True)
-        elif ext == 'pdf':
-            loader = PyPDFLoader(path)
-        elif ext == 'json':
-            loader = JSONLoader(path, jq_schema='.')
-        elif ext in ['doc', 'docx']:
-            loader = Docx2txtLoader(path)
-        elif ext in ['ppt', 'pptx']:
-            loader = UnstructuredPowerPointLoader(path)
-        elif ext in ['xls', 'xlsx']:
-            loader = UnstructuredExcelLoader(path)
+        ext = os.path.splitext(path)[1][1:].lower()
+        if ext == 'json':
+            with open(path, 'rb') as fd:
+                data_structure = json.load(fd)
+            # Hand the parsed object straight to the JSON splitter: no jq pass, no re-parsing its string form.
+            return self.json_splitter.create_documents([data_structure], convert_lists=True, metadatas=[{"source": path, "type": ext}])
         elif ext == 'csv':
+            with open(path, newline='') as fd:
+                fieldnames = next(csv.reader(fd, delimiter=',', quotechar='"'), [])
             loader = CSVLoader(file_path=path, csv_args={
                 'delimiter': ',',
                 'quotechar': '"',
-                'fieldnames': io.open(path).readline().strip().split(',')
+                'fieldnames': fieldnames
             })
-        elif ext == 'xml':
-            loader = UnstructuredXMLLoader(path)
-        elif ext == 'md':
-            loader = UnstructuredMarkdownLoader(path)
-        elif ext in ['html', 'htm']:
-            loader = UnstructuredHTMLLoader(path)
         elif ext in ['yaml', 'yml']:
-            data_structure = yaml.safe_load(open(path, 'r'))
-            data = Document(page_content=json.dumps(data_structure), metadata={"source": path})
-            return data
+            with open(path, 'r') as fd:
+                data_structure = yaml.safe_load(fd)
+            return [ Document(page_content=json.dumps(data_structure), metadata={"source": path, "type": ext}) ]
+        else:
+            loader = EXT_LOADERS[ext](path)
         documents = loader.load()
         [ doc.metadata.update({"type": ext}) for doc in documents ]
         return documents
@@ -122,48 +207,88 @@ class Hands(object):
         Return a mutated list of Document() objects containing the split chunks.
         '''
         result: list[Document] = []
+        texts: list[Document] = []
         for doc in data:
-            if doc.metadata['type'] in ['txt', 'md', 'html', 'htm', 'csv']:
-                splitter = RecursiveCharacterTextSplitter()
-                docs = splitter.split_documents([doc])
-                result.extend(docs)
-            elif doc.metadata['type'] in ['json', 'xml']:
-                splitter = RecursiveJsonSplitter()
-                docs = splitter.create_documents(doc.page_content, metadatas=doc.metadata)
-                result.extend(docs)
+            if doc.metadata['type'] in ['txt', 'md', 'html', 'htm', 'csv', 'xml']:
+                texts.append(doc)
             else:
                 result.append(doc)
+        # Split all the plain text documents in one pass.
+        result.extend(self.text_splitter.split_documents(texts))
         return result
 
     def ingest(self, path: str) -> int:
         '''
         Given a path, search the directory tree for supported files.
         Injest into the vector store for searching later.
+        With `pgvector.bulk` set, the HNSW index is dropped first and rebuilt once everything is in.
         '''
-        for path in self.recurseDirectory(path):
-            if path.split('.')[-1] in SUPPORTED_EXTS:
-                loadedDocs = self.loadText(path)
-                # log.debug({'texts': loadedDocs})
-                docs = self.splitText( loadedDocs )
-                # log.debug({'docs': docs})
-                vdata = []
-                texts = []
-                metadatas = []
-                for doc in docs:
-                    if self.db.similarity_search(doc.page_content, k=1):
-                        log.warning(f'Document {doc.metadata} already exists in the vector store.')
-                        continue
-                    vdata.extend(self.embeddings.embed_documents([doc.page_content]))
-                    texts.append(doc.page_content)
-                    metadatas.append(doc.metadata)
-                if texts and vdata and metadatas:
-                    self.db.add_embeddings(texts=texts, embeddings=vdata, metadatas=metadatas)
-                    self.db.add_documents([Document(page_content=text, **meta) for text, meta in zip(texts, metadatas)])
-                log.info(f'Ingested {path} with {len(vdata)} vectors.')
-            else:
-                log.warning(f'Unsupported file type: {path}')
+        bulk = self.config['pgvector'].get('bulk', False)
+        if bulk:
+            self.dropIndex()
+        try:
+            result = self._ingest(path)
+        except Exception:
+            if bulk:
+                try:
+                    self.buildIndex()
+                except Exception as e:
+                    # Don't let the rebuild hide why the ingest failed.
+                    log.error(f'Could not rebuild the index: {e}')
+            raise
+        if bulk:
+            self.buildIndex()
+        return result
+
+    def _ingest(self, path: str) -> int:
+        '''
+        Load, split, embed and store every supported file under the path.
+        Files are loaded and split on a thread pool while the main thread embeds and stores the ones
+        already read, in the order they were found. At most two files per worker are read ahead.
+        '''
+        workers = os.cpu_count() or 1
+        pending: deque = deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path in self.recurseDirectory(path):
+                pending.append((path, pool.submit(self.readDocuments, path)))
+                if len(pending) >= workers * 2:
+                    self.storeDocuments(*pending.popleft())
+            while pending:
+                self.storeDocuments(*pending.popleft())
         return 0
 
+    def readDocuments(self, path: str) -> list[Document]:
+        '''
+        Load a file and split it into chunks ready to embed.
+        '''
+        loadedDocs = self.loadText(path)
+        # log.debug({'texts': loadedDocs})
+        return self.splitText( loadedDocs )
+
+    def storeDocuments(self, path: str, reading: Future) -> None:
+        '''
+        Wait for a file's chunks, then embed and store the ones not already in the vector store.
+        '''
+        docs = reading.result()
+        # log.debug({'docs': docs})
+        texts = []
+        metadatas = []
+        hashes = [ hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest() for doc in docs ]
+        known = self.knownHashes(hashes)
+        for doc, digest in zip(docs, hashes):
+            if digest in known:
+                log.warning(f'Document {doc.metadata} already exists in the vector store.')
+                continue
+            known.add(digest)
+            doc.metadata['content_sha256'] = digest
+            texts.append(doc.page_content)
+            metadatas.append(doc.metadata)
+        vdata = self.embed(texts)
+        if texts and vdata and metadatas:
+            # One multi-row INSERT for the whole file; the text, vector and metadata all land in the same row.
+            self.db.add_embeddings(texts=texts, embeddings=vdata, metadatas=metadatas)
+        log.info(f'Ingested {path} with {len(vdata)} vectors.')
+
     def search(self, query: str) -> int:
         '''
         Given a query, search the vector store for similar documents.
@@ -56,6 +56,7 @@ setup_opts = {
         'langchain-ollama==0.1.3',
         'langchain-postgres==0.0.9',
         'langchain-text-splitters==0.2.2',
+        'SQLAlchemy>=2.0,<3.0',
         'TTS==0.22.0',
         'requests'
     ],
@@ -98,11 +99,13 @@ if 'sdist' in sys.argv:
         status = gpg.sign_file(fd, detach=True, output=f'{artifact}.asc')
         print(f'Signed {artifact} with {status.fingerprint}')
 
-        # create a MD5, SHA1 and SHA256 hash of the artifact.
-        for hashname in ['md5', 'sha1', 'sha256']:
-            hasher = getattr(hashlib, hashname)()
-            fd.seek(0,0)
-            hasher.update(fd.read())
+        # create a MD5, SHA1 and SHA256 hash of the artifact in a single streaming pass.
+        hashers = { hashname: hashlib.new(hashname) for hashname in ['md5', 'sha1', 'sha256'] }
+        fd.seek(0,0)
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+        for hashname, hasher in hashers.items():
             digest = hasher.hexdigest()
             checksums.write(f'''{hashname.upper()}:
 {digest} {artifact}
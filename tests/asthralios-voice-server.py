@@ -1,15 +1,18 @@
 #!/usr/bin/python3
 
-import sys, os, io
+import sys, os
+import struct
 import time
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import urllib
 
 import pasimple
-import numpy as np
-import scipy.io.wavfile as wavfile
 
 import torch
 from TTS.tts.configs.xtts_config import XttsConfig
@@ -24,8 +27,20 @@ LANG = os.environ.get('LANGUAGE', 'en')
 HOME = os.environ.get('HOME', '/home/stable-diffusion')
 PLAY_AUDIO = 'PLAY_AUDIO' in os.environ and os.environ['PLAY_AUDIO'].lower() not in ['', '0', 'false', 'no']
 
+def wavHeader(samples: int | None, rate: int, channels: int = 1, width: int = 2) -> bytes:
+    '''
+    Build the 44-byte RIFF/WAVE header for `samples` frames of `width`-byte PCM.
+    Pass None for a stream of unknown length; the sizes are then left at their maximum.
+    '''
+    data_len = 0xFFFFFFFF - 36 if samples is None else samples * channels * width
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_len, b'WAVE',
+        b'fmt ', 16, 1, channels, rate, rate * channels * width, channels * width, width * 8,
+        b'data', data_len)
+
 class LocalXttsContainer(object):
     _instance = None
+    _lock = threading.Lock()
 
     def __init__(self, config: kizano.Config):
         log.info('Loading TTS model...')
@@ -39,25 +54,124 @@ class LocalXttsContainer(object):
 
         log.info('> Loading checkpoint...')
         default_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        device = torch.device( config.get('device', default_device) )
-        self.model = Xtts(self.xconfig).to(device)
+        self.model = Xtts(self.xconfig)
         self.model.load_checkpoint(self.xconfig, checkpoint_dir=self.checkpoint_path, eval=True)
-        log.info('> Checkpoint loaded.')
-
-        log.info('Loading pulse client...')
-        self.pulse: pasimple.PaSimple = pasimple.PaSimple(
-            direction=pasimple.PA_STREAM_PLAYBACK,
-            rate=self.xconfig.audio.output_sample_rate,
-            format=pasimple.PA_SAMPLE_S16LE,
-            channels=1,
-            app_name='Asthralios',
-            stream_name='asthralios-test-voice',
+        # load_checkpoint() rebuilds the GPT and vocoder on the CPU, so only move the model once it's loaded.
+        self.model.to(torch.device( config.get('device', default_device) ))
+        device = next(self.model.parameters()).device
+        log.info(f'> Checkpoint loaded on {device}.')
+        # On the GPU the CPU only feeds kernels; a pool of OpenMP threads per core just fights over them.
+        # On the CPU the model needs those threads, so leave torch's defaults alone there.
+        threads = config.get('tts', {}).get('threads', 1 if device.type == 'cuda' else None)
+        if threads:
+            torch.set_num_threads(int(threads))
+            try:
+                torch.set_num_interop_threads(int(threads))
+            except RuntimeError as e:
+                log.warning(f'> Could not limit inter-op threads: {e}')
+        # TF32 matmuls cost nothing in quality for inference. Half precision is opt-in with tts.fp16;
+        # some voices click when the vocoder runs in FP16.
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        self.fp16 = bool(config.get('tts', {}).get('fp16', False)) and device.type == 'cuda'
+        # Requests are handled on their own threads, but only these workers run the model.
+        self.gpu = ThreadPoolExecutor(max_workers=int(config.get('tts', {}).get('concurrency', 1)), thread_name_prefix='xtts')
+        # speaker.wav never changes, so encode it into conditioning latents once instead of on every request.
+        self.speaker_wav = os.path.join(self.checkpoint_path, 'speaker.wav')
+        self.gpt_cond_latent, self.speaker_embedding = self.model.get_conditioning_latents(
+            audio_path=[self.speaker_wav],
+            gpt_cond_len=self.xconfig.gpt_cond_len,
+            gpt_cond_chunk_len=self.xconfig.gpt_cond_chunk_len,
+            max_ref_length=self.xconfig.max_ref_len,
+            sound_norm_refs=self.xconfig.sound_norm_refs,
         )
+        log.info('> Speaker latents computed.')
+        # 'default' rather than 'reduce-overhead': the GPT's KV cache grows every step, so CUDA graphs would keep re-recording.
+        if device.type == 'cuda' and config.get('tts', {}).get('compile', True):
+            self.compile(config.get('tts', {}).get('compile_mode', 'default'))
+
+        # Only connect to Pulse when the audio will actually be played here; headless servers may not have it.
+        self.pulse: pasimple.PaSimple = None
+        if PLAY_AUDIO:
+            log.info('Loading pulse client...')
+            self.pulse = pasimple.PaSimple(
+                direction=pasimple.PA_STREAM_PLAYBACK,
+                rate=self.xconfig.audio.output_sample_rate,
+                format=pasimple.PA_SAMPLE_S16LE,
+                channels=1,
+                app_name='Asthralios',
+                stream_name='asthralios-test-voice',
+            )
+
+    def compile(self, mode: str):
+        '''
+        Compile the GPT decoding step and the HiFi-GAN vocoder into fused kernels.
+        One warmup synthesis on a model worker pays the compile cost before the first request does.
+        Falls back to the eager model if compilation fails.
+        '''
+        gpt_forward = self.model.gpt.gpt_inference.forward
+        vocoder_forward = self.model.hifigan_decoder.forward
+        try:
+            log.info(f'> Compiling model ({mode})...')
+            self.model.gpt.gpt_inference.forward = torch.compile(gpt_forward, mode=mode, dynamic=True)
+            self.model.hifigan_decoder.forward = torch.compile(vocoder_forward, mode=mode, dynamic=True)
+            # Warm up on the worker that serves requests; compiled state like CUDA graphs is kept per thread.
+            self.gpu.submit(list, self.synthesize('Warming up.')).result()
+            log.info('> Model compiled.')
+        except Exception as e:
+            log.warning(f'> Could not compile the model, running it eagerly: {e}')
+            self.model.gpt.gpt_inference.forward = gpt_forward
+            self.model.hifigan_decoder.forward = vocoder_forward
+
+    def synthesize(self, text: str) -> Generator[torch.Tensor, None, None]:
+        '''
+        Synthesize the text in the cached speaker's voice with the sampling settings from the model config.
+        Yields waveform chunks as the decoder produces them, under FP16 autocast when tts.fp16 is set.
+        '''
+        with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.fp16):
+            yield from self.model.inference_stream(
+                text,
+                LANG,
+                self.gpt_cond_latent,
+                self.speaker_embedding,
+                stream_chunk_size=self.config.get('tts', {}).get('stream_chunk_size', 20),
+                temperature=self.xconfig.temperature,
+                length_penalty=self.xconfig.length_penalty,
+                repetition_penalty=self.xconfig.repetition_penalty,
+                top_k=self.xconfig.top_k,
+                top_p=self.xconfig.top_p,
+            )
+
+    def render(self, text: str, chunks: queue.SimpleQueue, cancelled: threading.Event):
+        '''
+        Synthesize the text into int16 PCM, putting each chunk's bytes on the queue as soon as it is ready.
+        Stops early once `cancelled` is set, so a client that hung up doesn't keep holding the model.
+        A None on the queue marks the end of the clip, whether or not synthesis succeeded.
+        '''
+        try:
+            for chunk in self.synthesize(text):
+                if cancelled.is_set():
+                    log.info('> Client went away; stopped synthesizing.')
+                    return
+                # The whole clip's peak isn't known while streaming; XTTS already emits samples in [-1, 1].
+                # Quantize where the chunk was generated so only the int16 samples cross to the host.
+                # XTTS keeps slices of the chunk for the next overlap, so it must not be modified in place.
+                audiobin = chunk.float().clamp(-1.0, 1.0).mul_(32767.0).to(torch.int16).cpu().numpy().tobytes()
+                chunks.put(audiobin)
+                if PLAY_AUDIO:
+                    self.pulse.write(audiobin)
+            if PLAY_AUDIO:
+                self.pulse.drain()
+                log.info('Done playing audio.')
+        finally:
+            chunks.put(None)
 
     @staticmethod
     def getInstance(config: kizano.Config):
         if LocalXttsContainer._instance is None:
-            LocalXttsContainer._instance = LocalXttsContainer(config)
+            with LocalXttsContainer._lock:
+                if LocalXttsContainer._instance is None:
+                    LocalXttsContainer._instance = LocalXttsContainer(config)
         return LocalXttsContainer._instance
 
 class VoiceHandler(BaseHTTPRequestHandler):
@@ -65,6 +179,17 @@ class VoiceHandler(BaseHTTPRequestHandler):
     Basic class to handle GET requests as text to synthesize and play.
     POST requests accept JSON that can be used to fiddle a few things before synthesizing and playing.
     '''
+    # Chunked transfer encoding needs HTTP/1.1.
+    protocol_version = 'HTTP/1.1'
+    # Set once in main() before the server starts accepting requests.
+    container: LocalXttsContainer = None
+
+    def writeChunk(self, data: bytes):
+        '''
+        Write one chunk of a chunked transfer-encoded body.
+        wfile is unbuffered, so the size line, data and trailer go out together in a single send.
+        '''
+        self.wfile.write(b''.join((b'%X\r\n' % len(data), data, b'\r\n')))
 
     def do_GET(self):
         '''
@@ -72,36 +197,46 @@ class VoiceHandler(BaseHTTPRequestHandler):
         '''
         # Get the url decoded path 
         text = urllib.parse.unquote(self.path.lstrip('/'))
-        container = LocalXttsContainer.getInstance()
+        container = self.container
+        # Refuse before the model is touched: nothing to say, or more than one request should hold the GPU for.
+        if not text.strip():
+            self.send_error(400, 'No text to synthesize.')
+            return
+        max_text = int(container.config.get('server', {}).get('max_text', 2000))
+        if len(text) > max_text:
+            self.send_error(413, f'Text is longer than {max_text} characters.')
+            return
 
         log.info(f'> Synthesizing text: {text}')
         now = time.time()
-        speaker_wav = os.path.join(container.checkpoint_path, 'speaker.wav')
-        wav = container.model.synthesize(text, config=container.xconfig, speaker_wav=speaker_wav, language=LANG)
-        log.debug(wav.keys())
-        log.info(f'> Text synthesized in {time.time() - now:.2f}s.')
-
-        npwav = wav['wav'].astype(np.float32)
-        audio = np.array(npwav * (32767.0 / max(0.01, np.max(np.abs(npwav)))), dtype=np.int16)
-        audiobin = audio.tobytes()
-
-        if PLAY_AUDIO:
-            log.info(f'> Playing audio for {len(audiobin)} samples...')
-            container.pulse.write(audiobin)
-            container.pulse.drain()
-            log.info('Done playing audio.')
-
-        buffer = io.BytesIO()
-        wavfile.write(buffer, container.xconfig.audio.sample_rate, audio)
-        buffer.seek(0, io.SEEK_END)
-        clength = buffer.tell()
-        buffer.seek(0, 0)
 
+        # Send the clip while it is still being generated: a WAV header of unknown length, then chunked PCM.
         self.send_response(200)
         self.send_header('Content-type', 'audio/wav')
-        self.send_header('Content-length', clength)
+        self.send_header('Transfer-Encoding', 'chunked')
         self.end_headers()
-        self.wfile.write(buffer.read())
+        self.writeChunk(wavHeader(None, container.xconfig.audio.output_sample_rate))
+
+        # The model's workers generate the clip; this thread only sends it, so a slow client never holds the model.
+        chunks = queue.SimpleQueue()
+        cancelled = threading.Event()
+        rendering = container.gpu.submit(container.render, text, chunks, cancelled)
+        samples = 0
+        try:
+            while (audiobin := chunks.get()) is not None:
+                if not samples:
+                    log.info(f'> First chunk synthesized in {time.time() - now:.2f}s.')
+                self.writeChunk(audiobin)
+                samples += len(audiobin) // 2
+        except (BrokenPipeError, ConnectionResetError):
+            # Nobody is left to drain the queue; have the worker stop at its next chunk.
+            cancelled.set()
+            self.close_connection = True
+            log.warning(f'> Client disconnected after {samples} samples.')
+            return
+        rendering.result()
+        self.wfile.write(b'0\r\n\r\n')
+        log.info(f'> Text synthesized in {time.time() - now:.2f}s ({samples} samples).')
 
 def main():
     '''
@@ -111,8 +246,8 @@ def main():
     config = kizano.getConfig()
     listen_host = config.get('server', {}).get('host', 'localhost')
     listen_port = config.get('server', {}).get('port', 5003)
-    LocalXttsContainer.getInstance(config)
-    server = HTTPServer((listen_host, listen_port), VoiceHandler)
+    VoiceHandler.container = LocalXttsContainer.getInstance(config)
+    server = ThreadingHTTPServer((listen_host, listen_port), VoiceHandler)
     log.info(f'Server listening on {listen_host}:{listen_port}.')
     server.serve_forever()
     return 0
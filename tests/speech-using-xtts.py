@@ -1,10 +1,13 @@
 #!/usr/bin/python3
 
 import sys, os
+import functools
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
 
 import pasimple
 import numpy as np
+import torch
+import TTS.tts.models.xtts as xtts
 from TTS.tts.configs.xtts_config import XttsConfig
 from TTS.tts.models.xtts import Xtts
 
@@ -12,26 +15,69 @@ import kizano
 log = kizano.getLogger(__name__)
 
 LANG = os.environ.get('LANGUAGE', 'en')
+# Half precision is opt-in, as with tts.fp16 in asthralios; some voices click when the vocoder runs in FP16.
+FP16 = 'FP16' in os.environ and os.environ['FP16'].lower() not in ['', '0', 'false', 'no']
 
-def main():
+def mmapCheckpoint(path: str, map_location=None, cache: bool = True, **kwargs) -> dict:
     '''
-    Assert the speech model works by loading it up and running a test sample through it.
+    Stand-in for TTS's load_fsspec() that memory-maps the checkpoint instead of reading all of it into RAM.
+    load_state_dict() then copies the weights straight out of the page cache, where the next run finds them again.
     '''
-    log.info('Welcome.')
+    return torch.load(path, map_location=map_location, mmap=True, **kwargs)
 
+@functools.lru_cache(maxsize=1)
+def getXttsModel(checkpoint_dir: str) -> tuple[XttsConfig, Xtts]:
+    '''
+    Load the XTTS config and checkpoint once per process; later calls with the same directory share them.
+    Call getXttsModel.cache_clear() to drop the model and release its memory.
+    '''
     log.info('Loading TTS model...')
     log.info('> New TTSv2 Config...')
     xtts_config = XttsConfig()
-    home = os.environ.get('HOME', '/home/stable-diffusion')
-    text = os.environ.get('MESSAGE', 'Greetings from dallas texas')
-    xtts_config.load_json(f"{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2/config.json")
+    xtts_config.load_json(os.path.join(checkpoint_dir, 'config.json'))
     log.info('> Config loaded.')
     # log.debug(xtts_config.__dict__)
 
     log.info('> Loading checkpoint...')
     model = Xtts(xtts_config)
-    model.load_checkpoint(xtts_config, checkpoint_dir=f"{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2/", eval=True)
+    xtts.load_fsspec = mmapCheckpoint
+    model.load_checkpoint(xtts_config, checkpoint_dir=checkpoint_dir, eval=True)
+    # load_checkpoint() builds the model on the CPU; move it over once it's loaded.
+    if torch.cuda.is_available():
+        model.cuda()
     log.info('> Checkpoint loaded.')
+    return xtts_config, model
+
+def getSpeakerLatents(model: Xtts, xtts_config: XttsConfig, speaker_wav: str, cache: str) -> tuple[torch.Tensor, torch.Tensor]:
+    '''
+    Encode the speaker's voice into XTTS conditioning latents, saving them to `cache` so later runs skip the encoder.
+    The cache is rebuilt whenever the speaker's recording is newer than it.
+    '''
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(speaker_wav):
+        log.info('> Loading cached speaker latents...')
+        return torch.load(cache, map_location=next(model.parameters()).device, weights_only=True)
+    log.info('> Computing speaker latents...')
+    latents = model.get_conditioning_latents(
+        audio_path=[speaker_wav],
+        gpt_cond_len=xtts_config.gpt_cond_len,
+        gpt_cond_chunk_len=xtts_config.gpt_cond_chunk_len,
+        max_ref_length=xtts_config.max_ref_len,
+        sound_norm_refs=xtts_config.sound_norm_refs,
+    )
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    torch.save(latents, cache)
+    return latents
+
+def main():
+    '''
+    Assert the speech model works by loading it up and running a test sample through it.
+    '''
+    log.info('Welcome.')
+
+    home = os.environ.get('HOME', '/home/stable-diffusion')
+    text = os.environ.get('MESSAGE', 'Greetings from dallas texas')
+    checkpoint_dir = f"{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2"
+    xtts_config, model = getXttsModel(checkpoint_dir)
 
     log.info('Loading pulse client...')
     pulse = pasimple.PaSimple(
@@ -44,14 +90,30 @@ def main():
     )
 
     log.info('> Synthesizing text...')
-    speaker_wav = f'{home}/.local/share/tts/tts_models--multilingual--multi-dataset--xtts_v2/speaker.wav'
-    wav = model.synthesize(text, config=xtts_config, speaker_wav=speaker_wav, language=LANG)
+    speaker_wav = os.path.join(checkpoint_dir, 'speaker.wav')
+    gpt_cond_latent, speaker_embedding = getSpeakerLatents(model, xtts_config, speaker_wav, os.path.join(home, '.cache', 'asthralios', 'xtts-speaker.pt'))
+    # XTTS hands the waveform back through .numpy(), which has no bfloat16, so autocast is FP16 and CUDA only.
+    device = next(model.parameters()).device
+    with torch.inference_mode(), torch.autocast(device_type='cuda', dtype=torch.float16, enabled=FP16 and device.type == 'cuda'):
+        wav = model.inference(
+            text,
+            LANG,
+            gpt_cond_latent,
+            speaker_embedding,
+            temperature=xtts_config.temperature,
+            length_penalty=xtts_config.length_penalty,
+            repetition_penalty=xtts_config.repetition_penalty,
+            top_k=xtts_config.top_k,
+            top_p=xtts_config.top_p,
+        )
     log.debug(wav.keys())
     log.info('> Text synthesized.')
 
     log.info('> Playing audio...')
-    npwav = wav['wav'].astype(np.float32)
-    audio = np.array(npwav * (32768.0 / max(0.01, np.max(np.abs(npwav)))), dtype=np.int16)
+    # Scale and cast to int16 in a single pass into the output buffer; 32767 keeps the peak from wrapping around.
+    npwav = np.asarray(wav['wav'], dtype=np.float32)
+    audio = np.empty(npwav.shape, dtype=np.int16)
+    np.multiply(npwav, 32767.0 / max(0.01, npwav.max(), -npwav.min()), out=audio, casting='unsafe')
     pulse.write(audio.tobytes())
     log.info('Done.')
 
@@ -1,6 +1,10 @@
 #!/usr/bin/python3
 
 import sys, os
+import wave
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator
 import pasimple
 import numpy as np
 from TTS.api import TTS
@@ -11,6 +15,30 @@ import kizano
 log = kizano.getLogger(__name__)
 local = bool(os.environ.get('LOCAL', None))
 where = 'local' if local else 'remote'
+# One pool for the process; retries cover the TTS server still warming up its model.
+http = urllib3.PoolManager(maxsize=4, retries=urllib3.Retry(total=3, backoff_factor=0.3))
+# Samples handed to Pulse per write; playback starts after the first frame instead of after the whole clip.
+FRAME = 4096
+
+def readWav(path: str) -> tuple[int, bytes]:
+    '''
+    Return the sample rate and the raw PCM frames of a WAV file, without its header.
+    A header left open-ended by a streaming server is fine; the frames are read up to the end of the file.
+    '''
+    with wave.open(path, 'rb') as fd:
+        # Never ask for more frames than the file could hold; an open-ended header claims about 4GiB.
+        frames = min(fd.getnframes(), os.path.getsize(path) // fd.getsampwidth())
+        return fd.getframerate(), fd.readframes(frames)
+
+def synthesizeAhead(tts: TTS, text: str) -> Generator[np.ndarray, None, None]:
+    '''
+    Synthesize the text a sentence at a time, yielding each sentence's samples in order.
+    A worker thread keeps synthesizing the following sentences while the caller plays the current one.
+    '''
+    sentences = tts.synthesizer.split_into_sentences(text)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        for future in [ pool.submit(tts.tts, sentence, speed=1.0, split_sentences=False) for sentence in sentences ]:
+            yield np.asarray(future.result(), dtype=np.float32)
 
 def main():
     '''
@@ -22,17 +50,7 @@ def main():
     '''
     log.info('Welcome.')
 
-    log.info('Opening a connection to Pulse for playback...')
-    stream = pasimple.PaSimple(
-        direction=pasimple.PA_STREAM_PLAYBACK,
-        rate=22050,
-        format=pasimple.PA_SAMPLE_S16LE,
-        channels=1,
-        app_name='Asthralios',
-        stream_name='asthralios-test-voice',
-    )
-    log.info('Done connecting to Pulseaudio.')
-
+    wav = pcm = None
     if not os.path.exists('/tmp/x.wav'):
         text = os.environ.get('WELCOME_MESG', 'Welcome to Asthralios. I am your voice assistant.')
         log.info(f'Opening a connection to {where} TTS...')
@@ -40,7 +58,6 @@ def main():
         if local:
             tts = TTS("tts_models/en/jenny/jenny").to(device=torch.device('cpu'))
         else:
-            request = urllib3.PoolManager()
             TTS_API = os.environ.get('TTS_API', None)
             if TTS_API == 'tts':
                 params = {
@@ -48,32 +65,57 @@ def main():
                     # 'speaker_id': 'Dionisio Schuyler', # Nice deep voice.
                     'speaker_id': 'Filip Traverse', # cute irish accent
                 }
-                response = request.request('GET', 'http://tts/api/tts', fields=params)
+                response = http.request('GET', 'http://tts/api/tts', fields=params, preload_content=False)
             elif TTS_API == 'kizano':
-                response = request.request('GET', f'http://tts/{text}')
+                response = http.request('GET', f'http://tts/{text}', preload_content=False)
 
         log.info('Done connecting to TTS.')
 
         log.info('Generating a welcome message...')
         if local:
-            wav = np.array(tts.tts(text, speed=1.0, split_sentences=True))
+            # Nothing is synthesized yet; sentences are generated while the ones before them play.
+            wav = synthesizeAhead(tts, text)
+            rate = tts.synthesizer.output_sample_rate
         else:
-            # The response back will be audio/wav, so be prepared to play this directly.
-            open('/tmp/x.wav', 'wb').write(response.data)
-            wav = response.data
+            # The response back will be audio/wav; copy it to disk as it arrives and parse its header to get at the samples.
+            with open('/tmp/x.wav', 'wb') as fd:
+                shutil.copyfileobj(response, fd, 65536)
+            response.release_conn()
+            rate, pcm = readWav('/tmp/x.wav')
     else:
-        wav = open('/tmp/x.wav', 'rb').read()
-    log.info(f'Done generating welcome message. Length: {len(wav)} samples.')
+        rate, pcm = readWav('/tmp/x.wav')
+    if pcm is not None:
+        log.info(f'Done generating welcome message. Length: {len(pcm) // 2} samples.')
+
+    log.info('Opening a connection to Pulse for playback...')
+    stream = pasimple.PaSimple(
+        direction=pasimple.PA_STREAM_PLAYBACK,
+        rate=rate,
+        format=pasimple.PA_SAMPLE_S16LE,
+        channels=1,
+        app_name='Asthralios',
+        stream_name='asthralios-test-voice',
+    )
+    log.info('Done connecting to Pulseaudio.')
 
     log.info('Playing the welcome message...')
-    if local:
-        npwav = np.array(wav, dtype=np.float32)
-        audio = np.array(npwav * (32768 / max(0.01, np.max(np.abs(npwav)))), dtype=np.int16).tobytes()
+    # Play wav using the pasimple output module, a frame at a time.
+    if pcm is None:
+        # Each frame is scaled and cast into the same int16 buffer just before it is written.
+        # Every sentence gets the same fixed scale; normalizing each to its own peak made the loudness jump between them.
+        audio = np.empty(FRAME, dtype=np.int16)
+        for npwav in wav:
+            log.info(f'Audio length: {len(npwav)} samples.')
+            np.clip(npwav, -1.0, 1.0, out=npwav)
+            for i in range(0, len(npwav), FRAME):
+                frame = audio[:len(npwav[i:i + FRAME])]
+                np.multiply(npwav[i:i + FRAME], 32767.0, out=frame, casting='unsafe')
+                stream.write(frame.tobytes())
     else:
-        audio = wav
-    log.info(f'Audio length: {len(audio)} samples.')
-    # Play wav using the pasimple output module
-    stream.write(audio)
+        log.info(f'Audio length: {len(pcm) // 2} samples.')
+        for i in range(0, len(pcm), FRAME * 2):
+            stream.write(pcm[i:i + FRAME * 2])
+    stream.drain()
     stream.close()
     log.info('Complete.')
     return 0